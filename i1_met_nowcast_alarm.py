@@ -8,7 +8,20 @@ Copyright (c) 2025 the_louie
 import appdaemon.plugins.hass.hassapi as hass
 import json
 import os
-from datetime import datetime, timedelta, timezone
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+except ImportError:
+    _loads = json.loads
+
+    def _dumps(obj):
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
 
 
 class RainWarning(hass.Hass):
@@ -20,42 +33,102 @@ class RainWarning(hass.Hass):
         self.nowcast_sensor = self.args.get("nowcast_sensor")
         self.door_sensors = self.args.get("door_window_sensors", [])
         self.persons = self.args.get("persons", [])
+        self.notify_group = self.args.get("notify_group")
+        self.debug = self.args.get("debug", False)
 
         # Validation
-        if not all([self.nowcast_sensor, self.door_sensors, self.persons]):
-            self.log("Error: Missing required configuration (nowcast_sensor, door_window_sensors, or persons)", level="ERROR")
+        if not self.nowcast_sensor:
+            missing = "nowcast_sensor"
+        elif not self.door_sensors:
+            missing = "door_window_sensors"
+        elif not self.persons and not self.notify_group:
+            missing = "persons or notify_group"
+        else:
+            missing = None
+        if missing:
+            self.log(f"Error: Missing required configuration ({missing})", level="ERROR")
             return
 
+        # Notification targets, deduplicated across persons sharing a service
+        if self.notify_group:
+            self._notify_services = (self.notify_group,)
+        else:
+            self._notify_services = tuple(dict.fromkeys(person["notify"] for person in self.persons if person.get("notify")))
+
         # State tracking
-        self.last_notification_time = None
+        self.last_notification_time = None  # Wall-clock time, for the debug log
+        self.last_notification_mono = None  # Monotonic time, for the cooldown
         self.notification_cooldown = 180  # 3 minutes cooldown
+        self._forecast_cache = (None, None, [], [])  # (raw json, parsed list, rainy epoch times, rainy entries)
 
         # Logging setup
         self.log_dir = os.path.join(os.path.dirname(__file__), "logs")
-        self.ensure_log_directory()
+        self._log_fp = None
+        self._log_date = None
+        if self.debug:
+            self.ensure_log_directory()
 
-        # Listen for state changes on door sensors
+        # Track door states locally, updated by state listeners
+        self._door_states = {sensor: self.get_state(sensor) for sensor in self.door_sensors}
         for sensor in self.door_sensors:
-            self.listen_state(self.check_rain_forecast, sensor)
+            self.listen_state(self._on_door, sensor)
 
-        # Start periodic rain check
-        self.run_every(self.check_rain_forecast, "now", 5 * 60)  # Every 5 minutes
+        # Re-check whenever the nowcast forecast is updated
+        self.listen_state(self.check_rain_forecast, self.nowcast_sensor, attribute="forecast_json")
+
+        # Low-frequency safety check in case a forecast update is missed
+        self.run_every(self._periodic_check, "now", 30 * 60)  # Every 30 minutes
+
+    def terminate(self):
+        """Close the debug log file when the app is stopped."""
+        self._close_debug_log()
 
     def ensure_log_directory(self):
         """Ensure the log directory exists."""
         try:
-            if not os.path.exists(self.log_dir):
-                os.makedirs(self.log_dir)
-        except Exception as e:
+            os.makedirs(self.log_dir, exist_ok=True)
+        except OSError as e:
             self.log(f"Error creating log directory: {e}", level="ERROR")
 
-    def log_notification_debug(self, forecast_data, rain_found, rain_minutes, door_states, trigger_entity=None, trigger_state=None):
+    def _periodic_check(self, kwargs):
+        """Scheduler callback for the periodic forecast check."""
+        self.check_rain_forecast()
+
+    def _on_door(self, entity, attribute, old, new, **kwargs):
+        """Update the cached door state and check the forecast when a door opens."""
+        was_open = self._door_states.get(entity) == "on"
+        self._door_states[entity] = new
+        if new == "on" and not was_open:
+            self.check_rain_forecast(entity, attribute, old, new, **kwargs)
+
+    def get_forecast(self, nowcast_state):
+        """Return the parsed forecast with the epoch times of its rainy entries, reusing the cache if unchanged."""
+        cached_state, forecast_data, rain_times, rain_entries = self._forecast_cache
+        if nowcast_state is cached_state or nowcast_state == cached_state:
+            return forecast_data, rain_times, rain_entries
+
+        forecast_data = _loads(nowcast_state)
+        rain_times = []
+        rain_entries = []
+        dget = dict.get
+        for forecast in forecast_data:
+            # Cheap precipitation filter first, most entries are dry
+            if (dget(forecast, "precipitation") or 0) <= 0:
+                continue
+            forecast_datetime = dget(forecast, "datetime")
+            if not forecast_datetime:
+                continue
+            forecast_time = datetime.fromisoformat(forecast_datetime.replace("Z", "+00:00"))
+            rain_times.append(forecast_time.timestamp())
+            rain_entries.append(forecast)
+
+        self._forecast_cache = (nowcast_state, forecast_data, rain_times, rain_entries)
+        return forecast_data, rain_times, rain_entries
+
+    def log_notification_debug(self, forecast_data, relevant_forecast, rain_found, rain_minutes, door_states, trigger_entity=None, trigger_state=None):
         """Log debug information when a notification is sent."""
         try:
             now = datetime.now(timezone.utc)
-            log_filename = f"rain_warning_debug_{now.strftime('%Y%m%d')}.log"
-            log_path = os.path.join(self.log_dir, log_filename)
-
             debug_info = {
                 "timestamp": now.isoformat(),
                 "trigger": {
@@ -67,12 +140,12 @@ class RainWarning(hass.Hass):
                     "total_forecasts": len(forecast_data),
                     "rain_found": rain_found,
                     "rain_minutes": rain_minutes,
-                    "forecast_data": forecast_data
+                    "relevant_forecast": relevant_forecast
                 },
                 "door_states": door_states,
                 "notification_cooldown": {
                     "last_notification": self.last_notification_time.isoformat() if self.last_notification_time else None,
-                    "cooldown_remaining": max(0, self.notification_cooldown - (now - self.last_notification_time).total_seconds()) if self.last_notification_time else 0
+                    "cooldown_remaining": max(0, self.notification_cooldown - (time.monotonic() - self.last_notification_mono)) if self.last_notification_mono is not None else 0
                 },
                 "configuration": {
                     "nowcast_sensor": self.nowcast_sensor,
@@ -81,97 +154,109 @@ class RainWarning(hass.Hass):
                 }
             }
 
-            with open(log_path, "a", encoding="utf-8") as f:
-                f.write(f"\n{'='*80}\n")
-                f.write(f"RAIN WARNING NOTIFICATION DEBUG LOG\n")
-                f.write(f"{'='*80}\n")
-                f.write(f"Timestamp: {debug_info['timestamp']}\n")
-                f.write(f"Trigger: {debug_info['trigger']}\n")
-                f.write(f"Rain Found: {rain_found} (in {rain_minutes} minutes)\n")
-                f.write(f"Door States: {door_states}\n")
-                f.write(f"Cooldown: {debug_info['notification_cooldown']}\n")
-                f.write(f"Configuration: {debug_info['configuration']}\n")
-                f.write(f"Full Forecast Data: {json.dumps(forecast_data, indent=2)}\n")
-                f.write(f"{'='*80}\n")
+            # Write the log off the notification path
+            self.run_in(self._write_debug_log_cb, 0, log_date=now.strftime("%Y%m%d"), payload=debug_info)
+
+        except Exception as e:
+            self.log(f"Error logging debug information: {e}", level="ERROR")
+
+    def _close_debug_log(self):
+        """Close the open debug log file, if any."""
+        # initialize() may have returned early on invalid configuration
+        if getattr(self, "_log_fp", None):
+            self._log_fp.close()
+            self._log_fp = None
+
+    def _write_debug_log_cb(self, kwargs):
+        """Write a debug log entry prepared by log_notification_debug."""
+        try:
+            log_date = kwargs["log_date"]
+            debug_info = kwargs["payload"]
+            log_path = os.path.join(self.log_dir, f"rain_warning_debug_{log_date}.log")
+
+            # Keep one buffered file open per day, reopening when the date rolls over
+            if self._log_fp is None or log_date != self._log_date:
+                self._close_debug_log()
+                self._log_fp = open(log_path, "ab", buffering=8192)
+                self._log_date = log_date
+
+            # Rotate the log once it grows past the size limit
+            if self._log_fp.tell() > 1_000_000:  # 1 MB
+                self._close_debug_log()
+                os.replace(log_path, log_path + ".1")
+                self._log_fp = open(log_path, "ab", buffering=8192)
+
+            # One NDJSON record per notification, flushed since notifications are infrequent
+            self._log_fp.write(_dumps(debug_info) + b"\n")
+            self._log_fp.flush()
 
             self.log(f"Debug information logged to {log_path}", level="INFO")
 
         except Exception as e:
-            self.log(f"Error logging debug information: {e}", level="ERROR")
+            self.log(f"Error writing debug log: {e}", level="ERROR")
 
     def check_rain_forecast(self, entity=None, attribute=None, old=None, new=None, **kwargs):
         """Check if rain is expected within 15 minutes and doors are open."""
+        # Skip spurious state events where nothing changed
+        if entity is not None and old == new:
+            return
+
+        nowcast_sensor = self.nowcast_sensor
         try:
-            # Skip if door closed (only check when door opens)
-            if entity and new != "on":
+            if entity and entity != nowcast_sensor and new != "on":
+                # Skip if door closed (only check when door opens)
                 return
 
             # First check rain forecast - if no rain expected, no need to check doors
-            nowcast_state = self.get_state(self.nowcast_sensor, attribute="forecast_json")
+            nowcast_state = self.get_state(nowcast_sensor, attribute="forecast_json")
             if not nowcast_state:
                 return
 
-            forecast_data = json.loads(nowcast_state)
-            now = datetime.now(timezone.utc)
-            threshold_time = now + timedelta(minutes=30)
-
-            # Check for rain within 30 minutes
-            rain_found = False
-            rain_minutes = 0
-            rain_start_time = None
-            for forecast in forecast_data:
-                if not forecast.get("datetime"):
-                    continue
-
-                forecast_time = datetime.fromisoformat(forecast["datetime"].replace("Z", "+00:00"))
-                if forecast_time > threshold_time:
-                    break  # No need to check further
-
-                if (forecast_time >= now and
-                    forecast.get("precipitation", 0) > 0):
-                    rain_found = True
-                    rain_minutes = int((forecast_time - now).total_seconds() / 60)
-                    rain_start_time = forecast_time
-                    break
+            forecast_data, rain_times, rain_entries = self.get_forecast(nowcast_state)
+            now_epoch = time.time()
+            threshold_epoch = now_epoch + 30 * 60
 
+            # Check for rain within 30 minutes (rainy entries are time-ordered)
+            lo = bisect_left(rain_times, now_epoch)
+            hi = bisect_right(rain_times, threshold_epoch)
+            rain_found = lo < hi
             if not rain_found:
                 return  # No rain expected
 
+            rain_minutes = int((rain_times[lo] - now_epoch) / 60)
+            rain_start_time = datetime.fromtimestamp(rain_times[lo], timezone.utc)
+
             # Rain expected, now check if any doors are open
-            door_states = {}
-            doors_open = False
-            for sensor in self.door_sensors:
-                state = self.get_state(sensor)
-                door_states[sensor] = state
-                if state == "on":
-                    doors_open = True
-
-            if not doors_open:
+            if "on" not in self._door_states.values():
                 return  # No doors open
 
             # Both conditions met, check cooldown and send notification
-            if (self.last_notification_time is None or
-                (now - self.last_notification_time).total_seconds() >= self.notification_cooldown):
+            now_mono = time.monotonic()
+            if (self.last_notification_mono is None or
+                now_mono - self.last_notification_mono >= self.notification_cooldown):
 
                 # Log debug information before sending notification
-                self.log_notification_debug(
-                    forecast_data=forecast_data,
-                    rain_found=rain_found,
-                    rain_minutes=rain_minutes,
-                    door_states=door_states,
-                    trigger_entity=entity,
-                    trigger_state=new
-                )
+                if self.debug:
+                    door_states = dict(self._door_states)
+                    self.log_notification_debug(
+                        forecast_data=forecast_data,
+                        relevant_forecast=rain_entries[lo:hi],
+                        rain_found=rain_found,
+                        rain_minutes=rain_minutes,
+                        door_states=door_states,
+                        trigger_entity=entity,
+                        # new is the full forecast_json payload on nowcast triggers
+                        trigger_state=new if entity in self._door_states else None
+                    )
 
                 # Format the rain start time in local time
                 local_rain_time = rain_start_time.astimezone().strftime("%H:%M")
                 message = f"⚠️ Rain Warning: Rain expected in {rain_minutes} minutes (at {local_rain_time}) and doors are open!"
-                for person in self.persons:
-                    notify_service = person.get("notify")
-                    if notify_service:
-                        self.call_service(f"notify/{notify_service}", message=message)
+                for notify_service in self._notify_services:
+                    self.call_service(f"notify/{notify_service}", message=message)
 
-                self.last_notification_time = now
+                self.last_notification_time = datetime.fromtimestamp(now_epoch, timezone.utc)
+                self.last_notification_mono = now_mono
                 self.log("Rain warning notification sent", level="INFO")
 
         except Exception as e: